@@ -1,6 +1,9 @@
 # Load environment variables from root .env file
 import os
 import sys
+import hashlib
+import threading
+from collections import OrderedDict
 from pathlib import Path
 from dotenv import load_dotenv
 import logging # <<< Import logging
@@ -22,7 +25,7 @@ from ortools.constraint_solver import routing_enums_pb2
 from ortools.constraint_solver import pywrapcp
 from datetime import datetime, timedelta, timezone
 import pytz # For robust timezone handling if needed, though ISO strings often include offset
-from typing import List, Literal
+from typing import List, Literal, Optional
 
 # --- Get logger instance ---
 logger = logging.getLogger(__name__) # <<< Get logger
@@ -84,6 +87,37 @@ def seconds_to_iso(seconds: int) -> str:
     # Use isoformat() with 'Z' suffix for explicit UTC indication
     return dt.isoformat(timespec='seconds').replace('+00:00', 'Z')
 
+# --- Solution Cache ---
+# The scheduler re-submits an identical problem when nothing changed since its last run
+# (no new jobs, same availability). Solving is by far the most expensive step, so the most
+# recent solver responses are kept, keyed by a digest of the request payload.
+# Set OPTIMIZER_SOLUTION_CACHE_SIZE=0 to disable.
+SOLUTION_CACHE_MAX_ENTRIES = int(os.environ.get("OPTIMIZER_SOLUTION_CACHE_SIZE", "32"))
+_solution_cache: "OrderedDict[str, OptimizationResponsePayload]" = OrderedDict()
+_solution_cache_lock = threading.Lock() # The endpoint runs in FastAPI's threadpool
+
+def payload_digest(payload: OptimizationRequestPayload) -> str:
+    """Returns a stable digest identifying an optimization request payload."""
+    return hashlib.sha256(payload.model_dump_json().encode("utf-8")).hexdigest()
+
+def get_cached_solution(key: str) -> Optional[OptimizationResponsePayload]:
+    """Returns the cached response for a payload digest (marking it recently used), or None."""
+    with _solution_cache_lock:
+        response = _solution_cache.get(key)
+        if response is not None:
+            _solution_cache.move_to_end(key)
+        return response
+
+def store_cached_solution(key: str, response: OptimizationResponsePayload) -> None:
+    """Caches a solver response, evicting the least recently used entries beyond the limit."""
+    if SOLUTION_CACHE_MAX_ENTRIES <= 0:
+        return
+    with _solution_cache_lock:
+        _solution_cache[key] = response
+        _solution_cache.move_to_end(key)
+        while len(_solution_cache) > SOLUTION_CACHE_MAX_ENTRIES:
+            _solution_cache.popitem(last=False)
+
 # --- FastAPI App ---
 
 app = FastAPI(
@@ -107,9 +141,14 @@ async def health_check():
             summary="Solve the vehicle routing problem for job scheduling",
             tags=["Optimization"]
             )
-async def optimize_schedule(payload: OptimizationRequestPayload) -> OptimizationResponsePayload:
+def optimize_schedule(payload: OptimizationRequestPayload) -> OptimizationResponsePayload:
     """
     Accepts a detailed scheduling problem description and returns optimized routes.
+
+    Declared as a plain (non-async) function so FastAPI runs the Python model setup and result
+    processing in its worker threadpool rather than on the event loop. The OR-Tools search itself
+    holds the GIL, so within one process solves still run one at a time and stall the loop while
+    they search; parallel solves need several worker processes (e.g. `uvicorn --workers N`).
     """
     # print("--- Entering /optimize-schedule endpoint ---") # Added entry log
     # <<< Replace print with logger call >>>
@@ -155,18 +194,47 @@ async def optimize_schedule(payload: OptimizationRequestPayload) -> Optimization
         # --- Calculate Planning Epoch ---
         # Use the earliest technician start time as the reference point (epoch) for relative time calculations.
         try:
-            planning_epoch_seconds = min(iso_to_seconds(t.earliestStartTimeISO) for t in payload.technicians)
+            # Parse each technician's start time once; reused for the time windows and route reconstruction.
+            tech_start_seconds = [iso_to_seconds(t.earliestStartTimeISO) for t in payload.technicians]
+            planning_epoch_seconds = min(tech_start_seconds)
             logger.info(f"Planning Epoch (Earliest Tech Start): {planning_epoch_seconds} ({seconds_to_iso(planning_epoch_seconds)}) UTC") # Changed print to logger.info
         except ValueError as e: 
              logger.error(f"Error calculating planning epoch: {e}") # Changed print to logger.error
              raise HTTPException(status_code=400, detail="Invalid technician start times provided.")
 
+        # --- Skip re-solving an unchanged problem ---
+        # No digest or lookup when the cache is disabled
+        solution_cache_key = payload_digest(payload) if SOLUTION_CACHE_MAX_ENTRIES > 0 else None
+        if solution_cache_key is not None:
+            cached_response = get_cached_solution(solution_cache_key)
+            if cached_response is not None:
+                logger.info("Identical payload solved recently; returning cached solution without re-solving.")
+                return cached_response
+
+        # --- Trivial fast path ---
+        # If no item is a fixed-time job and none lists a technician present in this payload, nothing
+        # can be scheduled, so the result is known without building or solving a routing model.
+        payload_technician_ids = {t.id for t in payload.technicians}
+        has_schedulable_item = any(
+            (item.isFixedTime and item.fixedTimeISO)
+            or any(tech_id in payload_technician_ids for tech_id in item.eligibleTechnicianIds)
+            for item in payload.items
+        )
+        if not has_schedulable_item:
+            logger.info("No item has an eligible technician in this payload; skipping the solver.")
+            return OptimizationResponsePayload(
+                status='error',
+                message='Optimization failed. No item has an eligible technician.',
+                routes=[],
+                unassignedItemIds=[item.id for item in payload.items]
+            )
+
         num_locations = len(payload.locations)
         num_vehicles = len(payload.technicians)
         num_items = len(payload.items)
         
-        # Map item IDs to their index in the payload.items list for easier lookup
-        item_id_to_payload_index = {item.id: i for i, item in enumerate(payload.items)}
+        # Map item IDs to their payload item for O(1) lookup
+        item_by_id = {item.id: item for item in payload.items}
         # Map solver indices back to location IDs/coords for travel matrix lookup
         location_index_map = {loc.index: loc for loc in payload.locations}
         
@@ -194,115 +262,136 @@ async def optimize_schedule(payload: OptimizationRequestPayload) -> Optimization
         # Define a large cost to represent infeasibility
         INFEASIBLE_COST = 9999999 
 
-        # Travel time callback
-        def travel_time_callback(from_index_mgr, to_index_mgr):
-            """Returns travel time in seconds between two solver indices."""
-            from_node = manager.IndexToNode(from_index_mgr)
-            to_node = manager.IndexToNode(to_index_mgr)
-            
-            try:
-                from_loc_idx = location_index_map.get(from_node)
-                to_loc_idx = location_index_map.get(to_node)
-                
-                if from_loc_idx is None or to_loc_idx is None:
-                    logger.warning(f"Warning: Invalid node index encountered in travel_time_callback ({from_node} or {to_node})") # Changed print to logger.warning
-                    return INFEASIBLE_COST # Use defined constant
-
-                from_loc_payload_idx = from_loc_idx.index 
-                to_loc_payload_idx = to_loc_idx.index
-
-                # REVIEW NOTE (Travel Time Error Handling): 
-                # Uses .get() with a large default cost (INFEASIBLE_COST).
-                # If a travel time entry is missing from the payload matrix, this segment
-                # becomes prohibitively expensive, effectively preventing the solver from using it.
-                # This is acceptable, but relies on the upstream service providing a complete matrix.
-                # Extensive missing data could lead to suboptimal or failed plans.
-                travel_time = payload.travelTimeMatrix.get(from_loc_payload_idx, {}).get(to_loc_payload_idx, INFEASIBLE_COST)
+        # --- Travel Time Matrix ---
+        # Materialize a dense node x node travel time matrix once per request. Everything the solver
+        # evaluates below is derived from it, so no Python callback runs during the search.
+        # REVIEW NOTE (Travel Time Error Handling): 
+        # Missing entries default to a large cost (INFEASIBLE_COST).
+        # If a travel time entry is missing from the payload matrix, this segment
+        # becomes prohibitively expensive, effectively preventing the solver from using it.
+        # This is acceptable, but relies on the upstream service providing a complete matrix.
+        # Extensive missing data could lead to suboptimal or failed plans.
+        travel_time_matrix = [[INFEASIBLE_COST] * num_locations for _ in range(num_locations)]
+        missing_location_nodes = [node for node in range(num_locations) if node not in location_index_map]
+        if missing_location_nodes:
+            logger.warning(f"Warning: No location provided for node indices {missing_location_nodes}. Travel to/from them is infeasible.")
+        for from_node in range(num_locations):
+            if from_node not in location_index_map:
+                continue
+            payload_row = payload.travelTimeMatrix.get(from_node, {})
+            matrix_row = travel_time_matrix[from_node]
+            for to_node in range(num_locations):
+                if to_node not in location_index_map:
+                    continue
+                travel_time = payload_row.get(to_node, INFEASIBLE_COST)
                 # Add a check for negative travel times, which are invalid
                 if travel_time < 0:
-                    logger.warning(f"Warning: Negative travel time ({travel_time}) found for {from_loc_payload_idx} -> {to_loc_payload_idx}. Using INFEASIBLE_COST.")
-                    return INFEASIBLE_COST
-                return travel_time
-            except Exception as e:
-                logger.error(f"TRAVEL_CALLBACK EXCEPTION: Nodes {from_node} -> {to_node}. Error: {e}. Large cost.", exc_info=True)
-                return INFEASIBLE_COST
+                    logger.warning(f"Warning: Negative travel time ({travel_time}) found for {from_node} -> {to_node}. Using INFEASIBLE_COST.")
+                    travel_time = INFEASIBLE_COST
+                matrix_row[to_node] = min(travel_time, INFEASIBLE_COST)
 
-        transit_callback_index = routing.RegisterTransitCallback(travel_time_callback)
+        # Travel time callback (used when reading routes back out of the solution)
+        def travel_time_callback(from_index_mgr, to_index_mgr):
+            """Returns travel time in seconds between two solver indices."""
+            return travel_time_matrix[manager.IndexToNode(from_index_mgr)][manager.IndexToNode(to_index_mgr)]
         
-        # --- NEW: Arc Cost Callback incorporating Eligibility --- 
-        # Helper to find item by location index safely
-        def find_item_by_location_idx(loc_idx):
-            for item in payload.items:
-                if item.locationIndex == loc_idx:
-                    return item
-            return None
-            
-        def arc_cost_callback(vehicle_index, from_index_mgr, to_index_mgr):
-            """Calculates arc cost: travel time + HUGE penalty if tech is ineligible for the destination node."""
-            technician_id = payload.technicians[vehicle_index].id
-            from_node = manager.IndexToNode(from_index_mgr)
-            to_node = manager.IndexToNode(to_index_mgr)
-
-            # 1. Get Base Travel Time
-            travel_cost = travel_time_callback(from_index_mgr, to_index_mgr)
-            if travel_cost >= INFEASIBLE_COST:
-                return INFEASIBLE_COST # If base travel is impossible, return infeasible cost
-
-            # 2. Check Eligibility for the *Destination* Node (to_node)
-            destination_item = find_item_by_location_idx(to_node)
-            
-            if destination_item: # Is the destination an item location?
-                # Check if the current vehicle's technician is eligible
-                if technician_id not in destination_item.eligibleTechnicianIds:
-                    # print(f"DEBUG ArcCost: Tech {technician_id} INELIGIBLE for Item {destination_item.id} at node {to_node}. Returning INFEASIBLE.")
-                    return INFEASIBLE_COST # Assign huge cost if ineligible
-            
-            # If destination is not an item or tech is eligible, return base travel cost
-            # print(f"DEBUG ArcCost: Tech {technician_id} eligible for node {to_node}. Cost: {travel_cost}")
-            return travel_cost
-
-        # Register the new arc cost callback for ALL vehicles
-        arc_cost_callback_index = routing.RegisterTransitCallback(lambda from_i, to_i: arc_cost_callback(0, from_i, to_i)) # Temp for registration?
-        # Need per vehicle callback registration
+        # --- NEW: Arc Cost incorporating Eligibility --- 
+        # Score eligibility for every (vehicle, node) pair in a single pass up front.
+        # Nodes that are not item locations (depots) are always eligible. As before, when several
+        # items share a location, the first one in the payload decides eligibility for that node.
+        # Per-item facts (first item at each node, its service time, the max priority) are gathered
+        # in one pass over payload.items rather than one pass each.
+        first_item_at_node = {}
+        service_time_by_node = [0] * num_locations # Depots have zero service time
+        max_priority = None
+        for item in payload.items:
+            if item.priority is not None and (max_priority is None or item.priority > max_priority):
+                max_priority = item.priority
+            if item.locationIndex not in first_item_at_node:
+                first_item_at_node[item.locationIndex] = item
+                if 0 <= item.locationIndex < num_locations:
+                    service_time_by_node[item.locationIndex] = item.durationSeconds
+        if max_priority is None:
+            max_priority = 1
+        # Each node's eligible technicians are encoded once as a bitmask over vehicle indices, so
+        # filling a vehicle's row is a single `&` per node instead of a scan of eligibleTechnicianIds.
+        vehicle_bits_by_tech_id = {}
+        for i, tech in enumerate(payload.technicians):
+            vehicle_bits_by_tech_id[tech.id] = vehicle_bits_by_tech_id.get(tech.id, 0) | (1 << i)
+        eligible_vehicle_mask_by_node = {}
+        for node, item in first_item_at_node.items():
+            if 0 <= node < num_locations:
+                eligible_vehicle_mask = 0
+                for tech_id in item.eligibleTechnicianIds:
+                    eligible_vehicle_mask |= vehicle_bits_by_tech_id.get(tech_id, 0)
+                eligible_vehicle_mask_by_node[node] = eligible_vehicle_mask
+        vehicle_node_eligibility = []
+        for i in range(num_vehicles):
+            vehicle_bit = 1 << i
+            eligible_row = [True] * num_locations
+            for node, eligible_vehicle_mask in eligible_vehicle_mask_by_node.items():
+                eligible_row[node] = bool(eligible_vehicle_mask & vehicle_bit)
+            vehicle_node_eligibility.append(eligible_row)
+
+        # Arc cost = travel time, or INFEASIBLE_COST if the tech is ineligible for the destination node.
+        # Costs are registered as transit matrices, which OR-Tools evaluates natively instead of
+        # calling back into Python for every arc it probes.
+        # Technicians with the same eligibility row have identical arc costs, so they share one
+        # registered matrix (memoized by eligibility signature), which also lets OR-Tools merge
+        # them into a single vehicle class.
+        # Travel times are already capped at INFEASIBLE_COST, so a tech eligible for every node
+        # reuses the travel matrix as-is; otherwise only the ineligible columns are overwritten.
+        arc_cost_callback_index_by_signature = {}
         vehicle_arc_cost_callback_indices = []
         for i in range(num_vehicles):
-            vehicle_arc_cost_callback_indices.append(
-                routing.RegisterTransitCallback(lambda from_i, to_i, vehicle_index=i: arc_cost_callback(vehicle_index, from_i, to_i))
-            )
-            
+            eligibility_signature = tuple(vehicle_node_eligibility[i])
+            callback_index = arc_cost_callback_index_by_signature.get(eligibility_signature)
+            if callback_index is None:
+                ineligible_nodes = [node for node, eligible in enumerate(eligibility_signature) if not eligible]
+                if not ineligible_nodes:
+                    arc_cost_matrix = travel_time_matrix
+                else:
+                    arc_cost_matrix = []
+                    for travel_row in travel_time_matrix:
+                        arc_cost_row = travel_row.copy()
+                        for node in ineligible_nodes:
+                            arc_cost_row[node] = INFEASIBLE_COST
+                        arc_cost_matrix.append(arc_cost_row)
+                callback_index = routing.RegisterTransitMatrix(arc_cost_matrix)
+                arc_cost_callback_index_by_signature[eligibility_signature] = callback_index
+            vehicle_arc_cost_callback_indices.append(callback_index)
+        logger.debug(f"Registered {len(arc_cost_callback_index_by_signature)} arc cost matrices for {num_vehicles} vehicles.")
+
         # Set the Arc Cost Evaluator for EACH vehicle using its specific callback index
         for i in range(num_vehicles):
              routing.SetArcCostEvaluatorOfVehicle(vehicle_arc_cost_callback_indices[i], i)
 
         # Service time (demand) callback
-        item_solver_indices = {} 
+        # Service durations are laid out as a flat array indexed by node (structure-of-arrays),
+        # filled in the item pass above rather than scanning payload.items on every call.
         def service_time_callback(index_mgr):
-            node = manager.IndexToNode(index_mgr)
-            for i, item in enumerate(payload.items):
-                if item.locationIndex == node:
-                    item_solver_indices[item.id] = index_mgr
-                    return item.durationSeconds
-            return 0 # Depots have zero service time
-
-        # Combined Transit + Service Time Callback for Time Dimension
-        def transit_plus_service_time_callback(from_index_mgr, to_index_mgr):
-            """Returns travel_time(from, to) + service_time(from)."""
-            travel = travel_time_callback(from_index_mgr, to_index_mgr)
-            service = service_time_callback(from_index_mgr)
+            return service_time_by_node[manager.IndexToNode(index_mgr)]
+
+        # Combined Transit + Service Time for Time Dimension: travel_time(from, to) + service_time(from)
+        combined_time_matrix = []
+        for from_node, travel_row in enumerate(travel_time_matrix):
+            service = service_time_by_node[from_node]
             # Add safety check for large costs indicating errors
-            if travel >= 999999 or service >= 999999:
-                 return 999999 # Propagate large cost if inputs were invalid
-            return travel + service
+            combined_time_matrix.append([
+                999999 if travel >= 999999 or service >= 999999 else travel + service # Propagate large cost if inputs were invalid
+                for travel in travel_row
+            ])
 
-        # Register the combined callback
-        combined_time_callback_index = routing.RegisterTransitCallback(transit_plus_service_time_callback)
+        # Register the combined matrix
+        combined_time_callback_index = routing.RegisterTransitMatrix(combined_time_matrix)
 
         # --- Dimensions ---
 
         # Time Dimension
         # Calculate the maximum horizon needed relative to the planning epoch
         # Ensure horizon is not negative if all end times are before the epoch (edge case)
-        max_end_time_abs = max(iso_to_seconds(t.latestEndTimeISO) for t in payload.technicians)
+        tech_end_seconds = [iso_to_seconds(t.latestEndTimeISO) for t in payload.technicians]
+        max_end_time_abs = max(tech_end_seconds)
         max_relative_horizon = max(0, max_end_time_abs - planning_epoch_seconds)
 
         # Define a practical horizon, e.g., max end time + buffer, or a fixed large number if all jobs must fit.
@@ -338,8 +427,8 @@ async def optimize_schedule(payload: OptimizationRequestPayload) -> Optimization
         for i, tech in enumerate(payload.technicians):
             # *** Populate the mapping INSIDE the loop ***
             tech_id_to_vehicle_index[tech.id] = i
-            start_seconds_abs = iso_to_seconds(tech.earliestStartTimeISO)
-            end_seconds_abs = iso_to_seconds(tech.latestEndTimeISO)
+            start_seconds_abs = tech_start_seconds[i]
+            end_seconds_abs = tech_end_seconds[i]
             
             # Convert to relative seconds
             start_seconds_rel = max(0, start_seconds_abs - planning_epoch_seconds)
@@ -371,16 +460,14 @@ async def optimize_schedule(payload: OptimizationRequestPayload) -> Optimization
         # Create lookup for actual fixed-time jobs (not breaks, which are handled by SetBreakIntervalsOfVehicle)
         fixed_job_times = {}
         try:
-            # Check items directly for isFixedTime and fixedTimeISO properties
-            item_based_times = {
+            # Check items directly for isFixedTime and fixedTimeISO properties.
+            # The comprehension is the lookup itself; no intermediate dict is copied into it.
+            fixed_job_times = {
                  item.id: iso_to_seconds(item.fixedTimeISO) - planning_epoch_seconds
                  for item in payload.items # Iterating over actual schedulable items only
                  if hasattr(item, 'isFixedTime') and item.isFixedTime and \
                     hasattr(item, 'fixedTimeISO') and item.fixedTimeISO
             }
-            if item_based_times:
-                logger.debug("Found fixed times for actual jobs in payload items", extra={"fixedJobTimesMap_fromItems": item_based_times})
-                fixed_job_times.update(item_based_times)
             
             if fixed_job_times:
                  logger.debug("Final fixed_job_times lookup map created (for actual fixed jobs)", extra={"fixedJobTimesMap_final": fixed_job_times})
@@ -456,6 +543,9 @@ async def optimize_schedule(payload: OptimizationRequestPayload) -> Optimization
             # For nodes that are not service locations (depots, etc.), service_time_callback returns 0.
             node_visit_transit = [service_time_callback(i) for i in range(routing.Size())]
 
+            # SetBreakIntervalsOfVehicle replaces a vehicle's breaks on every call, so intervals are
+            # indexed by vehicle first and each vehicle's full set of breaks is applied once below.
+            break_intervals_by_vehicle = {}
             for unavailability in payload.technicianUnavailabilities:
                 vehicle_index = tech_id_to_vehicle_index.get(unavailability.technicianId)
                 if vehicle_index is None:
@@ -483,8 +573,8 @@ async def optimize_schedule(payload: OptimizationRequestPayload) -> Optimization
                         f"Unavailability_Tech{unavailability.technicianId}_{unavailability_start_rel}"
                     )
                     
-                    time_dimension.SetBreakIntervalsOfVehicle([break_interval], vehicle_index, node_visit_transit)
-                    logger.debug("Applied technician unavailability as break interval", extra={
+                    break_intervals_by_vehicle.setdefault(vehicle_index, []).append(break_interval)
+                    logger.debug("Created break interval for technician unavailability", extra={
                         "technicianId": unavailability.technicianId,
                         "vehicleIndex": vehicle_index,
                         "startTimeRelative": unavailability_start_rel,
@@ -495,6 +585,17 @@ async def optimize_schedule(payload: OptimizationRequestPayload) -> Optimization
                     logger.error(f"Error applying unavailability for TechID {unavailability.technicianId}: Invalid ISO format or values. Error: {e}")
                 except Exception as e:
                     logger.error(f"Error applying unavailability for TechID {unavailability.technicianId}: {e}", exc_info=True)
+
+            for vehicle_index, break_intervals in break_intervals_by_vehicle.items():
+                try:
+                    time_dimension.SetBreakIntervalsOfVehicle(break_intervals, vehicle_index, node_visit_transit)
+                    logger.debug("Applied technician unavailabilities as break intervals", extra={
+                        "technicianId": payload.technicians[vehicle_index].id,
+                        "vehicleIndex": vehicle_index,
+                        "breakCount": len(break_intervals)
+                    })
+                except Exception as e:
+                    logger.error(f"Error applying break intervals for vehicle {vehicle_index}: {e}", exc_info=True)
         else:
             logger.info("No technician unavailabilities provided in payload.")
         # --- End Add Technician Unavailabilities ---
@@ -502,12 +603,13 @@ async def optimize_schedule(payload: OptimizationRequestPayload) -> Optimization
         # Technician Eligibility (Disjunctions) & Priority Penalties for actual jobs
         starts = [t.startLocationIndex for t in payload.technicians]
         ends = [t.endLocationIndex for t in payload.technicians]
+        depot_location_indices = set(starts) | set(ends) # O(1) membership for the per-item depot check
 
         # Add high penalty for dropping high-priority nodes
         # OR-Tools handles priority implicitly via penalties for dropping nodes
         # Higher penalty means less likely to be dropped.
         # Adjust penalty calculation as needed based on priority scale (e.g., 1 = highest)
-        max_priority = max((item.priority for item in payload.items if item.priority is not None), default=1)
+        # max_priority was collected in the single item pass above
         # base_penalty = 1000 # Base penalty for being unserved
         # <<< INCREASE PENALTY SIGNIFICANTLY >>>
         # Ensure penalty outweighs reasonable travel times. If max travel is ~1hr (3600s), penalty should be higher.
@@ -526,7 +628,7 @@ async def optimize_schedule(payload: OptimizationRequestPayload) -> Optimization
                 continue
 
             # Check if item is AT a depot location *before* getting solver index
-            is_at_depot_location = item.locationIndex in starts or item.locationIndex in ends
+            is_at_depot_location = item.locationIndex in depot_location_indices
             if is_at_depot_location:
                 logger.info(f"Info: Item {item.id} is at a depot location ({item.locationIndex}). Skipping disjunction.")
                 continue
@@ -537,13 +639,11 @@ async def optimize_schedule(payload: OptimizationRequestPayload) -> Optimization
                 logger.warning(f"Warning: Item {item.id} locIdx {item.locationIndex} resulted in invalid solver index -1. Skipping disjunction.")
                 continue # Should not happen due to check above, but safety first
 
-            eligible_vehicles = [
-                tech_idx for tech_idx, tech in enumerate(payload.technicians)
-                if tech.id in item.eligibleTechnicianIds # Check if tech's ID is in the item's eligible list
-            ]
+            # Only existence matters here, so stop at the first eligible technician present in the payload
+            has_eligible_vehicle = any(tech_id in payload_technician_ids for tech_id in item.eligibleTechnicianIds)
 
             # If a non-depot item has NO eligible vehicles, it cannot be served.
-            if not eligible_vehicles:
+            if not has_eligible_vehicle:
                 logger.info(f"Info: Item {item.id} has no eligible vehicles. Skipping disjunction.")
                 continue 
 
@@ -597,9 +697,9 @@ async def optimize_schedule(payload: OptimizationRequestPayload) -> Optimization
             search_parameters.log_search = False # Explicitly set to False if not enabled
             logger.info("OR-Tools detailed search logging DISABLED. Set ORTOOLS_LOG_SEARCH_ENABLED=true to enable.")
 
-        print("Starting OR-Tools solver...")
+        logger.info("Starting OR-Tools solver...")
         assignment = routing.SolveWithParameters(search_parameters)
-        print("Solver finished.")
+        logger.info("Solver finished.")
         # <<< Add Logging for Solver Status >>>
         status_code = routing.status()
 
@@ -630,19 +730,17 @@ async def optimize_schedule(payload: OptimizationRequestPayload) -> Optimization
 
         if assignment:
             logger.info("Solution found. Processing assignment...") # Changed print to logger.info
-            # Define helper to find item by location index safely
-            def find_item_by_location(loc_idx):
-                for item in payload.items:
-                    if item.locationIndex == loc_idx:
-                        return item
-                return None
             
             for vehicle_id in range(num_vehicles):
                 index = routing.Start(vehicle_id)
                 technician_id = payload.technicians[vehicle_id].id
                 route_stops: List[RouteStop] = []
                 total_travel_time_seconds = 0
+                # Route span kept as epoch seconds, so the total duration needs no ISO round-trip
+                first_stop_arrival_abs = None
+                last_stop_end_abs = None
                 is_first_segment = True # Flag to handle the first move differently
+                previous_stop_end_rel = None # Scheduled end of the stop at `index`, once one has been read
 
                 while True: # Loop until we explicitly break at the end node
                     # Get the next index in the route assigned by the solver
@@ -674,7 +772,7 @@ async def optimize_schedule(payload: OptimizationRequestPayload) -> Optimization
 
                     # --- Process the stop at `next_index` (it's not the end node) ---
                     node_index = manager.IndexToNode(next_index)
-                    current_item = find_item_by_location(node_index)
+                    current_item = first_item_at_node.get(node_index) # O(1) instead of scanning payload.items per stop
 
                     if current_item:
                         # REMOVE: Old filtering of break items from results, as they are no longer items.
@@ -684,10 +782,6 @@ async def optimize_schedule(payload: OptimizationRequestPayload) -> Optimization
                         # This is a regular job, add to assigned_item_ids and process for route_stops
                         assigned_item_ids.add(current_item.id)
 
-                        # --- Get relative times from solver ---
-                        current_start_time_var = time_dimension.CumulVar(next_index)
-                        current_start_time_rel = assignment.Value(current_start_time_var)
-                        
                         # --- Calculate Arrival Time using Slack Var ---
                         #current_slack_var = time_dimension.SlackVar(next_index)
                         #current_wait_time_rel = assignment.Value(current_slack_var) # Wait time before service
@@ -695,14 +789,16 @@ async def optimize_schedule(payload: OptimizationRequestPayload) -> Optimization
                         # --- End Arrival Time Calculation ---
                         
                         current_service_duration = current_item.durationSeconds # Duration is absolute
-                        current_end_time_rel = current_start_time_rel + current_service_duration
                         
                         # Calculate arrival time relative to planning epoch
                         if is_first_segment:
                             # For the first segment, departure is based on technician's earliest start
-                            tech_earliest_start_abs = iso_to_seconds(payload.technicians[vehicle_id].earliestStartTimeISO)
+                            tech_earliest_start_abs = tech_start_seconds[vehicle_id]
                             departure_from_index_rel = max(0, tech_earliest_start_abs - planning_epoch_seconds)
                             # No service duration at the actual start node
+                        elif previous_stop_end_rel is not None:
+                            # The previous node was a stop read in the last iteration; its end is its departure
+                            departure_from_index_rel = previous_stop_end_rel
                         else:
                             # For subsequent segments, departure is based on the previous stop's scheduled start + service
                             start_cumul_var = time_dimension.CumulVar(index)
@@ -713,9 +809,11 @@ async def optimize_schedule(payload: OptimizationRequestPayload) -> Optimization
                         # Physical arrival is departure + travel
                         physical_arrival_at_next_rel = departure_from_index_rel + segment_travel_time # <-- Use this for arrivalTimeISO
 
-                        # Scheduled start time is dictated by the solver, respecting constraints (like fixed times)
+                        # Scheduled start time is dictated by the solver, respecting constraints (like fixed times).
+                        # Each stop's cumul is read from the assignment once and reused as the next segment's departure.
                         scheduled_start_time_rel = assignment.Value(time_dimension.CumulVar(next_index)) # <-- Use this for startTimeISO
                         scheduled_end_time_rel = scheduled_start_time_rel + current_service_duration # <-- Use this for endTimeISO
+                        previous_stop_end_rel = scheduled_end_time_rel
                         # --- End Calculation ---
 
                         # --- Convert relative times to absolute Unix seconds ---
@@ -744,28 +842,27 @@ async def optimize_schedule(payload: OptimizationRequestPayload) -> Optimization
                             startTimeISO=seconds_to_iso(current_start_time_abs),
                             endTimeISO=seconds_to_iso(current_end_time_abs)
                         ))
+                        if first_stop_arrival_abs is None:
+                            first_stop_arrival_abs = arrival_at_next_abs
+                        last_stop_end_abs = current_end_time_abs
                     else:
+                        previous_stop_end_rel = None # Not a stop; the next departure is read from the solver
                         # This case should ideally not happen if only item locations are visited besides start/end
                         # unless an item is located *at* a depot.
                         # Let's verify if node_index corresponds to a start/end depot location for this vehicle.
                         tech_start_loc = payload.technicians[vehicle_id].startLocationIndex
                         tech_end_loc = payload.technicians[vehicle_id].endLocationIndex
                         if node_index == tech_start_loc:
-                            print(f"Debug: Vehicle {vehicle_id} visited its own start depot {node_index} mid-route?")
+                            logger.debug("Vehicle %s visited its own start depot %s mid-route?", vehicle_id, node_index)
                         elif node_index == tech_end_loc:
-                             print(f"Debug: Vehicle {vehicle_id} visited its own end depot {node_index} mid-route?")
+                             logger.debug("Vehicle %s visited its own end depot %s mid-route?", vehicle_id, node_index)
                         else:
                              # Check if it's another vehicle's depot
-                             is_any_depot = False
-                             for t in payload.technicians:
-                                 if node_index == t.startLocationIndex or node_index == t.endLocationIndex:
-                                     is_any_depot = True
-                                     break
-                             if is_any_depot:
-                                print(f"Debug: Vehicle {vehicle_id} visited depot node {node_index} (solver index {next_index}) mid-route. No item found.")
+                             if node_index in depot_location_indices:
+                                logger.debug("Vehicle %s visited depot node %s (solver index %s) mid-route. No item found.", vehicle_id, node_index, next_index)
                              else:
                                  # Truly unexpected node
-                                 print(f"Warning: Could not find item for non-depot node index {node_index} (solver index {next_index}) in route for vehicle {vehicle_id}")
+                                 logger.warning("Could not find item for non-depot node index %s (solver index %s) in route for vehicle %s", node_index, next_index, vehicle_id)
 
                     # Move to the next node for the next iteration
                     index = next_index
@@ -776,20 +873,17 @@ async def optimize_schedule(payload: OptimizationRequestPayload) -> Optimization
                 total_duration_seconds = 0
                 if route_stops:
                      # Duration from first arrival to last end time
-                     first_stop_arrival = iso_to_seconds(route_stops[0].arrivalTimeISO)
-                     last_stop_end = iso_to_seconds(route_stops[-1].endTimeISO)
-                     total_duration_seconds = last_stop_end - first_stop_arrival
+                     total_duration_seconds = last_stop_end_abs - first_stop_arrival_abs
                 
                 # Only add routes that actually have stops
                 if route_stops:
                     # Re-verify technician eligibility (should be guaranteed by solver if model is correct, but good practice)
                     is_route_valid = True
                     for stop in route_stops:
-                        item_payload_idx = item_id_to_payload_index.get(stop.itemId)
-                        if item_payload_idx is None: continue 
-                        item = payload.items[item_payload_idx]
+                        item = item_by_id.get(stop.itemId)
+                        if item is None: continue 
                         if technician_id not in item.eligibleTechnicianIds:
-                            print(f"Error: Solver assigned item {stop.itemId} to ineligible technician {technician_id}. Route invalid.")
+                            logger.error("Solver assigned item %s to ineligible technician %s. Route invalid.", stop.itemId, technician_id)
                             is_route_valid = False
                             # Mark items from this invalid route as unassigned
                             for s in route_stops: assigned_item_ids.discard(s.itemId)
@@ -814,17 +908,17 @@ async def optimize_schedule(payload: OptimizationRequestPayload) -> Optimization
             elif len(unassigned_item_ids) < num_items:
                 status = 'partial'
                 message = f'Optimization partially successful. {len(unassigned_item_ids)} items could not be scheduled.'
-                print(f"Unassigned items: {unassigned_item_ids}")
+                logger.info("Unassigned items: %s", unassigned_item_ids)
             else: # All items unassigned
                  status = 'error' # Treat as error if nothing could be scheduled
                  message = 'Optimization failed. No routes could be assigned.'
-                 print(f"All items were unassigned.")
+                 logger.info("All items were unassigned.")
 
             if assignment: # Check if a solution was found
-                print(f"Solver finished. Final Objective Value: {assignment.ObjectiveValue()}")
+                logger.info("Solver finished. Final Objective Value: %s", assignment.ObjectiveValue())
 
-            print(f"Returning status: {status}, message: {message}")
-            return OptimizationResponsePayload(
+            logger.info("Returning status: %s, message: %s", status, message)
+            response = OptimizationResponsePayload(
                 status=status,
                 message=message,
                 routes=routes,
@@ -833,22 +927,27 @@ async def optimize_schedule(payload: OptimizationRequestPayload) -> Optimization
         else:
             logger.error("No solution found by the solver.") # Changed print to logger.error
             # No solution found
-            return OptimizationResponsePayload(
+            response = OptimizationResponsePayload(
                 status='error',
                 message='Optimization failed. No solution found.',
                 routes=[],
                 unassignedItemIds=[item.id for item in payload.items] # All items are unassigned
             )
 
+        # Only cache results that scheduled every item. Every search is cut off by the 1 s time limit,
+        # so which items a failed or 'partial' solve leaves unassigned depends on the time budget and
+        # load rather than on the payload alone; an identical resubmission should search again.
+        if solution_cache_key is not None and assignment and response.status == 'success':
+            store_cached_solution(solution_cache_key, response)
+        return response
+
     except HTTPException as http_exc: # Re-raise HTTP exceptions
-         print(f"Caught HTTPException: {http_exc.detail}")
+         logger.warning("Caught HTTPException: %s", http_exc.detail)
          raise http_exc
     except Exception as e:
         # Catch any other unexpected error during processing
-        print(f"!!! UNHANDLED EXCEPTION in /optimize-schedule: {type(e).__name__}: {e}")
-        # Import traceback here if needed for more detail
-        import traceback
-        traceback.print_exc()
+        # logger.exception records the traceback as well
+        logger.exception("UNHANDLED EXCEPTION in /optimize-schedule: %s: %s", type(e).__name__, e)
         
         # Return a structured error response
         return OptimizationResponsePayload(
@@ -0,0 +1,20 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from main import app
+
+
+@pytest.fixture(scope="session")
+def client():
+    """Test client fixture for making API requests (app startup runs once per test session)."""
+    with TestClient(app) as c:
+        yield c
+
+
+@pytest.fixture(autouse=True)
+def clear_solution_cache():
+    """Keeps the module-level solution cache from leaking responses between tests."""
+    main._solution_cache.clear()
+    yield
+    main._solution_cache.clear()
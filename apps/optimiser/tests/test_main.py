@@ -1,5 +1,5 @@
+import copy
 import pytest
-from fastapi.testclient import TestClient
 from datetime import datetime, timedelta, timezone
 
 # Change relative imports to absolute relative to the optimize-service dir
@@ -43,6 +43,7 @@ SAMPLE_TRAVEL_MATRIX = {
     2: {0: 700, 1: 800, 2: 0}     # End -> Item(12m), Start(13m), End
 }
 
+# Shared by many tests: take copy.deepcopy() before mutating nested technicians/items.
 MINIMAL_VALID_PAYLOAD = {
     "locations": [SAMPLE_LOCATION_ITEM, SAMPLE_LOCATION_START_DEPOT, SAMPLE_LOCATION_END_DEPOT],
     "technicians": [SAMPLE_TECHNICIAN_1],
@@ -52,11 +53,7 @@ MINIMAL_VALID_PAYLOAD = {
 }
 
 
-@pytest.fixture(scope="module")
-def client():
-    """Test client fixture for making API requests."""
-    with TestClient(app) as c:
-        yield c
+# The shared `client` fixture lives in conftest.py
 
 # Removing fixtures that patch the non-existent main.EPOCH
 # @pytest.fixture
@@ -73,36 +70,33 @@ def client():
 
 # --- Helper Function Tests ---
 
-# Removed patch_main_epoch fixture argument
-def test_iso_to_seconds_conversion():
-    """Test iso_to_seconds conversion for various formats."""
-    # EPOCH is now fixed to Unix epoch in main.py
-
+@pytest.mark.parametrize("iso_string, expected_seconds", [
     # UTC Z format -> Correct expected timestamp
-    assert iso_to_seconds("2024-04-11T01:00:00Z") == 1712797200 # Unix timestamp for 2024-04-11 01:00:00 UTC
+    ("2024-04-11T01:00:00Z", 1712797200), # Unix timestamp for 2024-04-11 01:00:00 UTC
     # UTC +00:00 offset format
-    assert iso_to_seconds("2024-04-11T02:30:00+00:00") == 1712802600 # Unix timestamp for 2024-04-11 02:30:00 UTC
+    ("2024-04-11T02:30:00+00:00", 1712802600), # Unix timestamp for 2024-04-11 02:30:00 UTC
     # Other offset
-    assert iso_to_seconds("2024-04-11T05:00:00+02:00") == 1712804400 # This is 2024-04-11T03:00:00Z UTC
+    ("2024-04-11T05:00:00+02:00", 1712804400), # This is 2024-04-11T03:00:00Z UTC
     # Naive datetime (should assume UTC based on current implementation)
     # Note: Dependence on naive datetime assumption is risky. Prefer explicit offsets.
-    # Assuming it defaults to UTC
-    assert iso_to_seconds("2024-04-11T00:10:00") == 1712794200 # Unix timestamp for 2024-04-11 00:10:00 UTC
-
-# Removed patch_main_epoch fixture argument
-def test_seconds_to_iso_conversion():
+    ("2024-04-11T00:10:00", 1712794200), # Unix timestamp for 2024-04-11 00:10:00 UTC
+])
+def test_iso_to_seconds_conversion(iso_string, expected_seconds):
+    """Test iso_to_seconds conversion for various formats."""
+    # EPOCH is now fixed to Unix epoch in main.py
+    assert iso_to_seconds(iso_string) == expected_seconds
+
+@pytest.mark.parametrize("seconds, expected_iso", [
+    (1712797200, "2024-04-11T01:00:00Z"), # 01:00 UTC
+    (1712802600, "2024-04-11T02:30:00Z"), # 02:30 UTC
+    (0, "1970-01-01T00:00:00Z"), # Unix epoch itself
+    (1712794200, "2024-04-11T00:10:00Z"), # 00:10 UTC
+])
+def test_seconds_to_iso_conversion(seconds, expected_iso):
     """Test seconds_to_iso conversion back to ISO string."""
     # EPOCH is now fixed to Unix epoch in main.py
     # Expect 'Z' suffix from the updated function
-
-    # Corrected assertion: Input 1712797200 (01:00 UTC) should yield "2024-04-11T01:00:00Z"
-    assert seconds_to_iso(1712797200) == "2024-04-11T01:00:00Z"
-    # Corrected assertion: Input 1712802600 (02:30 UTC) should yield "2024-04-11T02:30:00Z"
-    assert seconds_to_iso(1712802600) == "2024-04-11T02:30:00Z"
-    # Test with Unix epoch itself
-    assert seconds_to_iso(0) == "1970-01-01T00:00:00Z"
-    # Test another value
-    assert seconds_to_iso(1712794200) == "2024-04-11T00:10:00Z" # 00:10 UTC
+    assert seconds_to_iso(seconds) == expected_iso
 
 # --- Endpoint Tests ---
 
@@ -123,7 +117,7 @@ def test_optimize_schedule_simple_success(client):
     """Test a simple scenario expected to succeed with one assigned stop."""
     # No explicit epoch patching needed. Use fixed known ISO strings.
 
-    payload = MINIMAL_VALID_PAYLOAD.copy()
+    payload = copy.deepcopy(MINIMAL_VALID_PAYLOAD)
     # Use a fixed, known date/time for technician window
     tech_start_iso = payload["technicians"][0]["earliestStartTimeISO"] # "2024-04-11T08:00:00Z"
     tech_start_seconds_unix = iso_to_seconds(tech_start_iso) # Absolute Unix timestamp
@@ -167,7 +161,7 @@ def test_optimize_schedule_fixed_constraint(client):
     """Test a scenario with a fixed time constraint."""
     # No explicit epoch patching needed.
 
-    payload = MINIMAL_VALID_PAYLOAD.copy()
+    payload = copy.deepcopy(MINIMAL_VALID_PAYLOAD)
     fixed_time_iso = "2024-04-11T10:00:00Z" # 10:00 AM UTC
     payload["fixedConstraints"] = [
         {"itemId": SAMPLE_ITEM_1["id"], "fixedTimeISO": fixed_time_iso}
@@ -216,7 +210,7 @@ def test_optimize_schedule_unassigned_due_to_time(client):
     """Test scenario where an item is unassigned due to tight technician time window."""
     # No explicit epoch patching needed.
 
-    payload = MINIMAL_VALID_PAYLOAD.copy()
+    payload = copy.deepcopy(MINIMAL_VALID_PAYLOAD)
 
     # Modify technician time window to be too short
     # Tech starts at 08:00 (28800s). Item is at start location (index 0), duration 1800s.
@@ -249,7 +243,7 @@ def test_optimize_schedule_unassigned_due_to_eligibility(client):
     """Test scenario where an item is unassigned because no technician is eligible."""
     # No epoch manipulation needed as timing isn't the primary factor here
 
-    payload = MINIMAL_VALID_PAYLOAD.copy()
+    payload = copy.deepcopy(MINIMAL_VALID_PAYLOAD)
 
     # Modify item eligibility so the existing technician (ID 1) is not eligible
     payload["items"][0]["eligibleTechnicianIds"] = [999] # Assign an ID that doesn't exist
@@ -262,7 +256,8 @@ def test_optimize_schedule_unassigned_due_to_eligibility(client):
     # Since this is the only item, status should be 'error'
     assert data["status"] == "error", f"Expected status 'error' when the only item is unassigned due to eligibility, got '{data['status']}' with message: {data.get('message')}"
     # Check for specific error messages
-    assert ("No routes could be assigned" in data["message"] or
+    assert ("No item has an eligible technician" in data["message"] or # Solver is skipped for this payload
+            "No routes could be assigned" in data["message"] or
             "No solution found" in data["message"] or
             f"{len(payload['items'])} items could not be scheduled" in data["message"] # Check for partial message if solver logic changes
            ), f"Unexpected error message: {data['message']}"
@@ -901,6 +896,157 @@ def test_optimize_schedule_final_travel_leg(client):
         f"Expected total travel time {expected_total_travel}s (final leg only), Got {route['totalTravelTimeSeconds']}s"
 
 
+def test_optimize_schedule_multiple_unavailabilities_same_tech(client):
+    """Test that every unavailability of a technician is applied, not just the last one."""
+    payload = {
+        "locations": [SAMPLE_LOCATION_ITEM, SAMPLE_LOCATION_START_DEPOT, SAMPLE_LOCATION_END_DEPOT],
+        "technicians": [dict(SAMPLE_TECHNICIAN_1, earliestStartTimeISO="2024-04-11T08:00:00Z", latestEndTimeISO="2024-04-11T17:00:00Z")],
+        "items": [dict(SAMPLE_ITEM_1, eligibleTechnicianIds=[1])],
+        "fixedConstraints": [],
+        "travelTimeMatrix": SAMPLE_TRAVEL_MATRIX,
+        # Back-to-back unavailability 08:00-12:00 and 12:00-15:00
+        "technicianUnavailabilities": [
+            {"technicianId": 1, "startTimeISO": "2024-04-11T08:00:00Z", "durationSeconds": 4 * 3600},
+            {"technicianId": 1, "startTimeISO": "2024-04-11T12:00:00Z", "durationSeconds": 3 * 3600},
+        ],
+    }
+
+    response = client.post("/optimize-schedule", json=payload)
+    assert response.status_code == 200
+    data = response.json()
+
+    assert data["status"] == "success", f"Expected status 'success', got '{data['status']}' with message: {data.get('message')}"
+    stop = data["routes"][0]["stops"][0]
+    # Neither break may overlap the job, so it cannot start before the second break ends
+    assert iso_to_seconds(stop["startTimeISO"]) >= iso_to_seconds("2024-04-11T15:00:00Z"), \
+        f"Job starts at {stop['startTimeISO']}, during a technician unavailability"
+
+
+def test_optimize_schedule_reuses_cached_solution(client, monkeypatch):
+    """Test that an identical payload is answered from the solution cache without re-solving."""
+    first_response = client.post("/optimize-schedule", json=MINIMAL_VALID_PAYLOAD)
+    assert first_response.status_code == 200
+
+    # Any attempt to build a new routing model means the cache was bypassed
+    def fail_if_solving(*args, **kwargs):
+        raise AssertionError("Solver should not run for a cached payload")
+    monkeypatch.setattr(main.pywrapcp, "RoutingModel", fail_if_solving)
+
+    second_response = client.post("/optimize-schedule", json=MINIMAL_VALID_PAYLOAD)
+    assert second_response.status_code == 200
+    assert second_response.json() == first_response.json()
+
+
+def test_optimize_schedule_does_not_cache_failed_solve(client, monkeypatch):
+    """Test that a solve that found no solution is retried on resubmission, not served from the cache."""
+    original_routing_model = main.pywrapcp.RoutingModel
+
+    class FailingRoutingModel(original_routing_model):
+        def SolveWithParameters(self, search_parameters):
+            return None # As when the search fails or times out
+    monkeypatch.setattr(main.pywrapcp, "RoutingModel", FailingRoutingModel)
+
+    failed_response = client.post("/optimize-schedule", json=MINIMAL_VALID_PAYLOAD)
+    assert failed_response.status_code == 200
+    assert failed_response.json()["message"] == "Optimization failed. No solution found."
+
+    monkeypatch.setattr(main.pywrapcp, "RoutingModel", original_routing_model)
+
+    retried_response = client.post("/optimize-schedule", json=MINIMAL_VALID_PAYLOAD)
+    assert retried_response.status_code == 200
+    assert retried_response.json()["status"] == "success", \
+        f"Expected the resubmitted payload to be solved again, got: {retried_response.json().get('message')}"
+
+
+def test_optimize_schedule_does_not_cache_partial_solve(client, monkeypatch):
+    """Test that a partial result (some items unassigned) is solved again on resubmission."""
+    # A second item at its own location that needs longer than the technician's whole window
+    payload = copy.deepcopy(MINIMAL_VALID_PAYLOAD)
+    payload["locations"].append({"id": "loc_item_long", "index": 3, "coords": SAMPLE_LAT_LNG_A})
+    payload["items"].append(dict(SAMPLE_ITEM_1, id="item_too_long", locationIndex=3, durationSeconds=12 * 3600))
+    payload["travelTimeMatrix"] = {
+        0: {0: 0, 1: 600, 2: 700, 3: 300},
+        1: {0: 600, 1: 0, 2: 800, 3: 600},
+        2: {0: 700, 1: 800, 2: 0, 3: 700},
+        3: {0: 300, 1: 600, 2: 700, 3: 0},
+    }
+
+    routing_model_count = []
+    original_routing_model = main.pywrapcp.RoutingModel
+
+    def counting_routing_model(*args, **kwargs):
+        routing_model_count.append(1)
+        return original_routing_model(*args, **kwargs)
+    monkeypatch.setattr(main.pywrapcp, "RoutingModel", counting_routing_model)
+
+    for _ in range(2):
+        response = client.post("/optimize-schedule", json=payload)
+        assert response.status_code == 200
+        data = response.json()
+        assert data["status"] == "partial", f"Expected status 'partial', got '{data['status']}' with message: {data.get('message')}"
+        assert data["unassignedItemIds"] == ["item_too_long"]
+
+    assert len(routing_model_count) == 2, "A partial result should not be served from the solution cache"
+
+
+def test_optimize_schedule_cache_disabled_skips_digest(client, monkeypatch):
+    """Test that the payload is not hashed when the solution cache is disabled."""
+    monkeypatch.setattr(main, "SOLUTION_CACHE_MAX_ENTRIES", 0)
+
+    def fail_if_hashing(payload):
+        raise AssertionError("Payload should not be hashed when the cache is disabled")
+    monkeypatch.setattr(main, "payload_digest", fail_if_hashing)
+
+    response = client.post("/optimize-schedule", json=MINIMAL_VALID_PAYLOAD)
+    assert response.status_code == 200
+    assert response.json()["status"] == "success"
+    assert not main._solution_cache
+
+
+def test_optimize_schedule_skips_solver_when_nothing_schedulable(client, monkeypatch):
+    """Test that a payload with no eligible technician for any item is answered without solving."""
+    payload = {
+        "locations": [SAMPLE_LOCATION_ITEM, SAMPLE_LOCATION_START_DEPOT, SAMPLE_LOCATION_END_DEPOT],
+        "technicians": [SAMPLE_TECHNICIAN_1],
+        "items": [dict(SAMPLE_ITEM_1, eligibleTechnicianIds=[999])],
+        "fixedConstraints": [],
+        "travelTimeMatrix": SAMPLE_TRAVEL_MATRIX,
+    }
+
+    def fail_if_solving(*args, **kwargs):
+        raise AssertionError("Solver should not run when no item can be scheduled")
+    monkeypatch.setattr(main.pywrapcp, "RoutingModel", fail_if_solving)
+
+    response = client.post("/optimize-schedule", json=payload)
+    assert response.status_code == 200
+    data = response.json()
+
+    assert data["status"] == "error", f"Expected status 'error', got '{data['status']}' with message: {data.get('message')}"
+    assert data["message"] == "Optimization failed. No item has an eligible technician."
+    assert data["routes"] == []
+    assert data["unassignedItemIds"] == [SAMPLE_ITEM_1["id"]]
+
+
+def test_optimize_schedule_assigns_only_eligible_technician(client):
+    """Test that an item eligible only for the second technician is routed to that technician."""
+    second_technician = dict(SAMPLE_TECHNICIAN_1, id=2)
+    payload = {
+        "locations": [SAMPLE_LOCATION_ITEM, SAMPLE_LOCATION_START_DEPOT, SAMPLE_LOCATION_END_DEPOT],
+        "technicians": [SAMPLE_TECHNICIAN_1, second_technician],
+        "items": [dict(SAMPLE_ITEM_1, eligibleTechnicianIds=[2])],
+        "fixedConstraints": [],
+        "travelTimeMatrix": SAMPLE_TRAVEL_MATRIX,
+    }
+
+    response = client.post("/optimize-schedule", json=payload)
+    assert response.status_code == 200
+    data = response.json()
+
+    assert data["status"] == "success", f"Expected status 'success', got '{data['status']}' with message: {data.get('message')}"
+    assert [route["technicianId"] for route in data["routes"]] == [2]
+    assert data["routes"][0]["stops"][0]["itemId"] == SAMPLE_ITEM_1["id"]
+
+
 # Add more tests here for:
 # - Correct translation to OR-Tools structures (might require mocking or inspecting internal state)
 # - Correct handling of solver results (verifying route structure, timings)